@@ -0,0 +1,56 @@
+import numpy as np
+
+# -----------------------------------------------------
+# Optional Numba acceleration
+# -----------------------------------------------------
+try:
+    import numba
+    from numba import njit, prange
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+
+if HAS_NUMBA:
+    @njit(parallel=True, cache=True)
+    def _count_labels(flat, nlabels, nchunks):
+        # One histogram per contiguous chunk avoids write contention; reduced
+        # at the end. Calling numba.get_thread_id() in here would make the
+        # kernel uncacheable, so the chunk count is passed in instead.
+        out = np.zeros((nchunks, nlabels), np.int64)
+        size = flat.size
+        for c in prange(nchunks):
+            for i in range(c * size // nchunks, (c + 1) * size // nchunks):
+                out[c, flat[i]] += 1
+        return out.sum(axis=0)
+
+
+def count_labels(labels, nlabels):
+    """Count voxels per label in an integer label array (values < nlabels)."""
+    flat = labels.ravel()
+    if HAS_NUMBA:
+        return _count_labels(flat, nlabels, numba.get_num_threads())
+    return np.bincount(flat, minlength=nlabels)
+
+
+def set_num_threads(n):
+    """Cap the threads used by the parallel kernels in this process."""
+    if HAS_NUMBA:
+        numba.set_num_threads(max(1, min(n, numba.config.NUMBA_NUM_THREADS)))
+
+
+def warm_kernels():
+    """Compile the kernels once so cache=True persists them for all workers.
+
+    MultiProc workers are fresh processes; with the on-disk cache populated
+    they load the compiled kernels instead of re-JITting per subject. Run
+    this in its own process (``python scripts/_kernels.py``): starting
+    Numba's threading layer in the pipeline's parent would make forked
+    workers abort under the GNU OpenMP layer.
+    """
+    # Same dtype and layout as the volumetry labels, so the cached
+    # specialization is the one actually used
+    count_labels(np.zeros((8, 8, 8), dtype=np.int8), 1)
+
+
+if __name__ == "__main__":
+    warm_kernels()
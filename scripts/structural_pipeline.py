@@ -5,6 +5,8 @@ from nipype.interfaces.fsl import BET, FAST
 from nipype.interfaces.freesurfer import ReconAll
 import os
 import shutil
+import subprocess
+import sys
 import numpy as np
 import nibabel as nib
 import pandas as pd
@@ -34,16 +36,39 @@ derivatives_dir = bids_root / "derivatives"
 pipeline_dir = derivatives_dir / "mri_pipeline"
 pipeline_dir.mkdir(parents=True, exist_ok=True)
 
+metrics_dir = pipeline_dir / "metrics"
+
 freesurfer_dir = derivatives_dir / "freesurfer"
 freesurfer_dir.mkdir(parents=True, exist_ok=True)
 
 # FreeSurfer environment
 os.environ["SUBJECTS_DIR"] = str(freesurfer_dir)
 
+# -----------------------------------------------------
+# CPU budget
+# -----------------------------------------------------
+# recon-all dominates runtime: run N_SUBJ of them side by side with OMP
+# threads each so the total never exceeds the available cores
+NCPU = os.cpu_count() or 4
+N_SUBJ = max(1, NCPU // 4)
+OMP = max(1, NCPU // N_SUBJ)
+
+os.environ["OMP_NUM_THREADS"] = str(OMP)
+
+# Volumetry: one reader thread per PVE map, and the same cap for the Numba
+# counting kernel (which would otherwise use every core)
+VOLUME_THREADS = min(NCPU, 3)
+
 # -----------------------------------------------------
 # Subject discovery (BIDS)
 # -----------------------------------------------------
-all_subjects = sorted([p.name for p in bids_root.glob("sub-*") if p.is_dir()])
+# One directory read; is_dir() only needs a stat for symlinked entries
+with os.scandir(bids_root) as entries:
+    all_subjects = sorted(
+        e.name for e in entries
+        if e.name.startswith("sub-") and e.is_dir()
+    )
+
 subjects = []
 for sid in all_subjects:
     t1_candidate = bids_root / sid / "anat" / f"{sid}_T1w.nii.gz"
@@ -56,6 +81,50 @@ if not subjects:
 log.info(f"Discovered {len(all_subjects)} subjects: {all_subjects}")
 log.info(f"Using {len(subjects)} subjects with T1w: {subjects}")
 
+# -----------------------------------------------------
+# Skip already-processed subjects
+# -----------------------------------------------------
+# Filtering here keeps finished subjects out of the graph entirely instead
+# of relying on Nipype's cache checks for every node. Set FORCE_REPROCESS=1
+# to rerun every subject, e.g. after changing the volumetry code.
+FORCE_REPROCESS = os.environ.get("FORCE_REPROCESS") == "1"
+
+# Also decides whether the reconall node is built below
+HAS_FREESURFER = shutil.which("recon-all") is not None
+
+def completed_subjects(metrics_dir, freesurfer_dir, require_recon, force=False):
+    import os
+    from pathlib import Path
+
+    suffix = "_tissue_volumes.parquet"
+    metrics_dir = Path(metrics_dir)
+    if force or not metrics_dir.is_dir():
+        return set()
+
+    # Only final metrics files count; an interrupted write leaves a .tmp
+    with os.scandir(metrics_dir) as entries:
+        done = {
+            e.name[:-len(suffix)] for e in entries
+            if e.name.endswith(suffix)
+        }
+
+    if require_recon:
+        done = {
+            sid for sid in done
+            if (Path(freesurfer_dir) / sid / "scripts" / "recon-all.done").exists()
+        }
+
+    return done
+
+done = completed_subjects(
+    metrics_dir,
+    freesurfer_dir,
+    require_recon=HAS_FREESURFER,
+    force=FORCE_REPROCESS
+)
+pending = [sid for sid in subjects if sid not in done]
+log.info(f"Skipping {len(subjects) - len(pending)} already-processed subjects")
+
 # -----------------------------------------------------
 # Workflow
 # -----------------------------------------------------
@@ -73,7 +142,7 @@ inputnode = Node(
 )
 
 inputnode.iterables = [
-    ("subject_id", subjects),
+    ("subject_id", pending),
 ]
 
 # -----------------------------------------------------
@@ -135,15 +204,16 @@ else:
 # -----------------------------------------------------
 # FreeSurfer recon-all
 # -----------------------------------------------------
-HAS_FREESURFER = shutil.which("recon-all") is not None
 reconall = None
 if HAS_FREESURFER:
     reconall = Node(
         ReconAll(
             directive="all",
-            openmp=4
+            openmp=OMP
         ),
-        name="reconall"
+        name="reconall",
+        # Lets MultiProc account for the OpenMP threads in its core budget
+        n_procs=OMP
     )
     reconall.inputs.subjects_dir = str(freesurfer_dir)
 else:
@@ -152,12 +222,31 @@ else:
 # -----------------------------------------------------
 # STEP 6 — Subject-level volumetry
 # -----------------------------------------------------
-def compute_tissue_volumes(seg_files, subject_id, output_dir):
+def compute_tissue_volumes(seg_files, subject_id, output_dir, n_threads=1):
+    import math
+    import os
+    import re
+    from concurrent.futures import ThreadPoolExecutor
+    from itertools import repeat
     import numpy as np
     import nibabel as nib
-    import pandas as pd
+    import pyarrow as pa
+    import pyarrow.parquet as pq
     from pathlib import Path
 
+    try:
+        from _kernels import count_labels, set_num_threads
+    except ImportError:
+        # scripts/ not importable from this worker; plain NumPy histogram
+        def count_labels(labels, nlabels):
+            return np.bincount(labels.ravel(), minlength=nlabels)
+
+        def set_num_threads(n):
+            pass
+
+    # Stay within the cores MultiProc reserved for this node
+    set_num_threads(n_threads)
+
     tissue_labels = {
         "CSF": 0,
         "GM": 1,
@@ -166,40 +255,96 @@ def compute_tissue_volumes(seg_files, subject_id, output_dir):
 
     volumes = {"subject_id": subject_id}
 
-    for seg_file in seg_files:
-        img = nib.load(seg_file)
-        data = img.get_fdata()
-        voxel_volume = np.prod(img.header.get_zooms())
-
-        for name, label in tissue_labels.items():
-            volumes[name] = np.sum(data == label) * voxel_volume
-
-    df = pd.DataFrame([volumes])
+    # FAST writes one partial volume map per tissue (pve_0/1/2), not a label map
+    def pve_index(seg_file):
+        match = re.search(r"_pve_(\d+)", str(seg_file))
+        if match is None:
+            raise ValueError(
+                f"Expected a FAST partial volume map (*_pve_N), got {seg_file}"
+            )
+        return int(match.group(1))
+
+    seg_files = sorted(seg_files, key=pve_index)
+
+    # Keeping the files open makes successive slabs forward seeks instead of
+    # re-decompressing each .nii.gz from its start; nibabel also only uses
+    # indexed_gzip for open files. Uncompressed .nii maps are memory-mapped.
+    imgs = [nib.load(f, mmap=True, keep_file_open=True) for f in seg_files]
+
+    # All maps share one grid; spatial zooms only (a 4th entry may be TR)
+    zooms = imgs[0].header.get_zooms()[:3]
+    voxel_volume = math.prod(float(z) for z in zooms)
+
+    # Stream the volume in Z slabs so peak memory is slab-sized
+    slab = 16
+    n_slices = imgs[0].shape[2]
+
+    def read_slab(img, z):
+        # Keep the on-disk dtype rather than upcasting to float64
+        return np.asarray(img.dataobj[:, :, z:z + slab])
+
+    background = len(tissue_labels)
+    counts = np.zeros(background + 1, dtype=np.int64)
+
+    # Decompress the maps concurrently; zlib releases the GIL, and threads
+    # avoid pickling volumes back from worker processes
+    with ThreadPoolExecutor(max_workers=min(n_threads, len(imgs))) as pool:
+        for z in range(0, n_slices, slab):
+            maps = list(pool.map(read_slab, imgs, repeat(z)))
+
+            # Voxel-major (X, Y, Z, 3) layout keeps a voxel's three
+            # probabilities adjacent in memory for the per-voxel reductions
+            stack = np.stack(maps, axis=-1)
+
+            # Hard segmentation: each voxel goes to its most probable tissue;
+            # voxels with no tissue probability at all (outside the brain)
+            # get their own bin
+            labels = stack.argmax(axis=-1).astype(np.int8)
+            labels[~stack.any(axis=-1)] = background
+            counts += count_labels(labels, background + 1)
+
+    for name, label in tissue_labels.items():
+        volumes[name] = int(counts[label]) * voxel_volume
 
     output_dir = Path(output_dir)
     output_dir.mkdir(parents=True, exist_ok=True)
 
-    out_file = output_dir / f"{subject_id}_tissue_volumes.tsv"
-    df.to_csv(out_file, sep="\t", index=False)
+    # Parquet lets the dataset summary read every subject in one columnar scan
+    out_file = output_dir / f"{subject_id}_tissue_volumes.parquet"
+    table = pa.Table.from_pydict({k: [v] for k, v in volumes.items()})
+
+    # Write then rename: an interrupted node must never leave a truncated
+    # file that would mark the subject as done on the next run
+    tmp_file = out_file.with_name(out_file.name + ".tmp")
+    pq.write_table(table, tmp_file)
+    os.replace(tmp_file, out_file)
 
     return str(out_file)
 
 volume_node = Node(
     Function(
-        input_names=["seg_files", "subject_id", "output_dir"],
+        input_names=["seg_files", "subject_id", "output_dir", "n_threads"],
         output_names=["out_file"],
         function=compute_tissue_volumes,
         imports=[
+            "import math",
+            "import os",
+            "import re",
+            "from concurrent.futures import ThreadPoolExecutor",
+            "from itertools import repeat",
             "import numpy as np",
             "import nibabel as nib",
-            "import pandas as pd",
+            "import pyarrow as pa",
+            "import pyarrow.parquet as pq",
             "from pathlib import Path",
         ],
     ),
-    name="volume_extraction"
+    name="volume_extraction",
+    n_procs=VOLUME_THREADS
 )
 
-volume_node.inputs.output_dir = str((pipeline_dir / "metrics").resolve())
+volume_node.inputs.output_dir = str(metrics_dir.resolve())
+volume_node.inputs.n_threads = VOLUME_THREADS
 volume_node.overwrite = True
 
 # -----------------------------------------------------
@@ -255,10 +400,21 @@ wf.connect(connections)
 if __name__ == "__main__":
     log.info("Starting structural MRI pipeline")
 
-    wf.run(
-        plugin="MultiProc",
-        plugin_args={
-            "n_procs": 4,
-            "memory_gb": 8
-        }
-    )
+    if not pending:
+        log.info("All subjects already processed; nothing to run")
+    else:
+        # Populate the Numba cache before MultiProc spawns its workers. This
+        # runs in a child process so Numba's threading layer never starts in
+        # the parent that MultiProc forks from.
+        subprocess.run(
+            [sys.executable, str(Path(__file__).with_name("_kernels.py"))],
+            check=True
+        )
+
+        wf.run(
+            plugin="MultiProc",
+            plugin_args={
+                "n_procs": NCPU,
+                "memory_gb": 8
+            }
+        )
@@ -1,6 +1,10 @@
 #!/usr/bin/env python3
 
+import os
 import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
 from pathlib import Path
 
 # -----------------------------
@@ -26,52 +30,75 @@ OUTPUT_CSV = SUMMARY_DIR / "dataset_summary.csv"
 if not PARTICIPANTS_FILE.exists():
     raise FileNotFoundError(f"participants.tsv not found at {PARTICIPANTS_FILE}. Expected under ds000246_mri.")
 
+PARTICIPANT_COLUMNS = ["participant_id", "age", "sex", "dominant_hand"]
+
 participants = pd.read_csv(PARTICIPANTS_FILE, sep="\t")
+# Missing columns and empty cells become "n/a" in one pass
+participants = participants.reindex(columns=PARTICIPANT_COLUMNS).fillna("n/a")
 
-rows = []
+# -----------------------------
+# Load per-subject metrics
+# -----------------------------
+# Each metrics Parquet file is a single row with columns: subject_id, CSF, GM, WM
+TISSUES = ["CSF", "GM", "WM"]
+METRICS_SUFFIX = "_tissue_volumes.parquet"
+METRICS_SCHEMA = pa.schema(
+    [("subject_id", pa.string())] + [(t, pa.float64()) for t in TISSUES]
+)
+
+
+def read_metrics(path):
+    """Read one subject's metrics table, or None if the file is unusable."""
+    try:
+        table = pq.read_table(path, columns=METRICS_SCHEMA.names)
+        return table.cast(METRICS_SCHEMA)
+    except Exception:
+        return None
+
+
+# One directory read instead of a stat() per file
+metrics_files = []
+if METRICS_DIR.is_dir():
+    with os.scandir(METRICS_DIR) as entries:
+        metrics_files = sorted(
+            e.path for e in entries
+            if e.name.endswith(METRICS_SUFFIX) and e.is_file()
+        )
+
+metrics_ids = {Path(f).name[:-len(METRICS_SUFFIX)] for f in metrics_files}
+
+# One columnar scan over all subjects instead of a reader per file
+try:
+    metrics_table = ds.dataset(
+        metrics_files, format="parquet", schema=METRICS_SCHEMA
+    ).to_table()
+except (pa.ArrowInvalid, OSError):
+    # Some file is unreadable: fall back to per-file reads and drop the bad
+    # ones, so those subjects get NaN volumes and fail QC instead of
+    # aborting the whole summary
+    tables = [t for t in map(read_metrics, metrics_files) if t is not None]
+    metrics_table = pa.concat_tables(tables or [METRICS_SCHEMA.empty_table()])
+
+metrics = metrics_table.to_pandas()
+
+metrics = metrics.rename(columns={"subject_id": "participant_id"})
 
 # -----------------------------
-# Iterate over subjects
+# Join participants with metrics
 # -----------------------------
-for _, row in participants.iterrows():
-    sub_id = row["participant_id"]
-
-    # Current pipeline outputs FAST partial volumes and a per-subject metrics TSV.
-    # Summarize based on metrics TSV presence and values.
-    metrics_tsv = METRICS_DIR / f"{sub_id}_tissue_volumes.tsv"
-
-    subject_data = {
-        "participant_id": sub_id,
-        "age": row.get("age", "n/a"),
-        "sex": row.get("sex", "n/a"),
-        "dominant_hand": row.get("dominant_hand", "n/a"),
-
-        # Outputs
-        "metrics_exists": metrics_tsv.exists(),
-    }
-
-    # If metrics exist, parse CSF/GM/WM volumes
-    if subject_data["metrics_exists"]:
-        try:
-            mdf = pd.read_csv(metrics_tsv, sep="\t")
-            # Expect columns: subject_id, CSF, GM, WM
-            subject_data["CSF"] = float(mdf.iloc[0].get("CSF", float("nan")))
-            subject_data["GM"] = float(mdf.iloc[0].get("GM", float("nan")))
-            subject_data["WM"] = float(mdf.iloc[0].get("WM", float("nan")))
-        except Exception:
-            subject_data["CSF"] = "n/a"
-            subject_data["GM"] = "n/a"
-            subject_data["WM"] = "n/a"
-
-    # Simple QC rule: metrics TSV present
-    subject_data["qc_pass"] = subject_data["metrics_exists"]
-
-    rows.append(subject_data)
+summary_df = participants.merge(metrics, on="participant_id", how="left")
+summary_df["metrics_exists"] = summary_df["participant_id"].isin(metrics_ids)
+
+# Simple QC rule: all tissue volumes present
+summary_df["qc_pass"] = summary_df[TISSUES].notna().all(axis=1)
+
+summary_df = summary_df.reindex(columns=[
+    *PARTICIPANT_COLUMNS, "metrics_exists", *TISSUES, "qc_pass",
+])
 
 # -----------------------------
 # Save summary CSV
 # -----------------------------
-summary_df = pd.DataFrame(rows)
 summary_df.to_csv(OUTPUT_CSV, index=False)
 
 print(f"✅ Dataset summary saved to: {OUTPUT_CSV}")
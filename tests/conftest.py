@@ -0,0 +1,31 @@
+import ast
+from pathlib import Path
+
+import pytest
+
+SCRIPTS_DIR = Path(__file__).resolve().parents[1] / "scripts"
+PIPELINE_FILE = SCRIPTS_DIR / "structural_pipeline.py"
+
+
+@pytest.fixture
+def pipeline_function(monkeypatch):
+    """Exec a single function from structural_pipeline.py in a fresh namespace.
+
+    This mirrors how Nipype's Function node runs it, and avoids importing the
+    script, which builds the whole workflow against the BIDS dataset.
+    """
+    # Make _kernels importable, as it is for the pipeline's worker processes
+    monkeypatch.syspath_prepend(str(SCRIPTS_DIR))
+
+    def load(name):
+        tree = ast.parse(PIPELINE_FILE.read_text())
+        func = next(
+            n for n in tree.body
+            if isinstance(n, ast.FunctionDef) and n.name == name
+        )
+        module = ast.Module(body=[func], type_ignores=[])
+        namespace = {}
+        exec(compile(module, str(PIPELINE_FILE), "exec"), namespace)
+        return namespace[name]
+
+    return load
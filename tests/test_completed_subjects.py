@@ -0,0 +1,50 @@
+import pytest
+
+
+@pytest.fixture
+def completed_subjects(pipeline_function):
+    return pipeline_function("completed_subjects")
+
+
+@pytest.fixture
+def derivatives(tmp_path):
+    metrics_dir = tmp_path / "metrics"
+    freesurfer_dir = tmp_path / "freesurfer"
+    metrics_dir.mkdir()
+
+    # Finished: metrics written and recon-all done
+    (metrics_dir / "sub-01_tissue_volumes.parquet").touch()
+    (freesurfer_dir / "sub-01" / "scripts").mkdir(parents=True)
+    (freesurfer_dir / "sub-01" / "scripts" / "recon-all.done").touch()
+
+    # Interrupted metrics write
+    (metrics_dir / "sub-02_tissue_volumes.parquet.tmp").touch()
+
+    # Metrics written but recon-all never finished
+    (metrics_dir / "sub-03_tissue_volumes.parquet").touch()
+
+    return metrics_dir, freesurfer_dir
+
+
+def test_requires_recon_all_done(derivatives, completed_subjects):
+    assert completed_subjects(*derivatives, require_recon=True) == {"sub-01"}
+
+
+def test_metrics_only_without_freesurfer(derivatives, completed_subjects):
+    done = completed_subjects(*derivatives, require_recon=False)
+
+    assert done == {"sub-01", "sub-03"}
+
+
+def test_force_reprocesses_everything(derivatives, completed_subjects):
+    done = completed_subjects(*derivatives, require_recon=False, force=True)
+
+    assert done == set()
+
+
+def test_missing_metrics_dir(tmp_path, completed_subjects):
+    done = completed_subjects(
+        tmp_path / "metrics", tmp_path / "freesurfer", require_recon=False
+    )
+
+    assert done == set()
@@ -0,0 +1,66 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+nib = pytest.importorskip("nibabel")
+pq = pytest.importorskip("pyarrow.parquet")
+
+
+@pytest.fixture
+def compute_tissue_volumes(pipeline_function):
+    return pipeline_function("compute_tissue_volumes")
+
+
+def write_pve_maps(tmp_path, labels, zooms=(2.0, 2.0, 2.0)):
+    """Write FAST-style pve_0/1/2 maps where each labelled voxel favours its tissue.
+
+    Voxels labelled -1 are background: zero probability in every map.
+    """
+    paths = []
+    for tissue in range(3):
+        pve = np.where(labels == tissue, 0.6, 0.2).astype(np.float32)
+        pve[labels < 0] = 0.0
+        img = nib.Nifti1Image(pve, np.diag([*zooms, 1.0]))
+        img.header.set_zooms(zooms)
+        path = tmp_path / f"sub-01_T1w_brain_pve_{tissue}.nii.gz"
+        nib.save(img, path)
+        paths.append(str(path))
+    return paths
+
+
+def test_volumes_from_out_of_order_pve_maps(tmp_path, compute_tissue_volumes):
+    # More than one 16-slice slab along Z
+    labels = np.full((4, 5, 20), -1, dtype=np.int8)
+    labels[:, :, 0:3] = 0
+    labels[:, :, 3:10] = 1
+    labels[:, :, 10:18] = 2
+    pve_files = write_pve_maps(tmp_path, labels)
+
+    out_file = compute_tissue_volumes(
+        [pve_files[2], pve_files[0], pve_files[1]],
+        "sub-01",
+        str(tmp_path / "metrics"),
+    )
+
+    assert not list((tmp_path / "metrics").glob("*.tmp"))
+    row = pq.read_table(out_file).to_pylist()[0]
+    voxel_volume = 8.0
+    assert row["subject_id"] == "sub-01"
+    assert row["CSF"] == 4 * 5 * 3 * voxel_volume
+    assert row["GM"] == 4 * 5 * 7 * voxel_volume
+    assert row["WM"] == 4 * 5 * 8 * voxel_volume
+
+
+def test_rejects_files_without_pve_suffix(tmp_path, compute_tissue_volumes):
+    labels = np.zeros((2, 2, 2), dtype=np.int8)
+    pve_files = write_pve_maps(tmp_path, labels)
+    renamed = tmp_path / "sub-01_seg.nii.gz"
+    Path(pve_files[0]).rename(renamed)
+
+    with pytest.raises(ValueError, match="_pve_N"):
+        compute_tissue_volumes(
+            [str(renamed), *pve_files[1:]],
+            "sub-01",
+            str(tmp_path / "metrics"),
+        )
@@ -0,0 +1,41 @@
+import importlib
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+SCRIPTS_DIR = Path(__file__).resolve().parents[1] / "scripts"
+
+
+@pytest.fixture
+def kernels(monkeypatch):
+    monkeypatch.syspath_prepend(str(SCRIPTS_DIR))
+    return importlib.import_module("_kernels")
+
+
+@pytest.mark.parametrize("size", [1001, 5])
+@pytest.mark.parametrize("nchunks", [1, 3, 8])
+def test_chunked_counts_match_bincount(kernels, size, nchunks):
+    if not kernels.HAS_NUMBA:
+        pytest.skip("numba not installed")
+    # Sizes that don't divide evenly, including fewer voxels than chunks
+    labels = np.random.default_rng(0).integers(0, 4, size).astype(np.int8)
+
+    counts = kernels._count_labels(labels, 4, nchunks)
+
+    np.testing.assert_array_equal(counts, np.bincount(labels, minlength=4))
+
+
+def test_count_labels_with_thread_cap(kernels):
+    labels = np.random.default_rng(1).integers(0, 4, (7, 11, 13)).astype(np.int8)
+
+    previous = kernels.numba.get_num_threads() if kernels.HAS_NUMBA else 1
+    kernels.set_num_threads(3)
+    try:
+        counts = kernels.count_labels(labels, 4)
+    finally:
+        kernels.set_num_threads(previous)
+
+    np.testing.assert_array_equal(
+        counts, np.bincount(labels.ravel(), minlength=4)
+    )